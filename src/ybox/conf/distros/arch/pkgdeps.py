@@ -1,15 +1,21 @@
 import argparse
+import glob
 import gzip
 import os
+import pickle
 import re
+import stat
 import sys
 import time
 import zlib
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Iterable, Optional, Tuple
 
 import ijson  # type: ignore
+import orjson
 
 from ybox.cmd import run_command
 from ybox.print import print_error, print_notice, print_warn
@@ -18,14 +24,72 @@ _AUR_META_URL = "https://aur.archlinux.org/packages-meta-ext-v1.json.gz"
 _PKG_CACHE_SUBDIR = os.path.basename(__file__).removesuffix(".py")
 _AUR_META_CACHE_DIR = f"{os.path.expanduser('~/.cache')}/{_PKG_CACHE_SUBDIR}"
 _AUR_META_FILE = f"{_AUR_META_CACHE_DIR}/packages-meta-ext-v1.json.gz"
+# cached maps of pacman packages, and pacman+AUR packages, keyed by the mtimes of their sources
+_PACMAN_MAPS_CACHE = f"{_AUR_META_CACHE_DIR}/pacman-maps.pkl"
+_ALL_MAPS_CACHE = f"{_AUR_META_CACHE_DIR}/all-maps.pkl"
+_PACMAN_SYNC_DBS = "/var/lib/pacman/sync/*.db"
 # parallel download using aria2 is much faster on slower networks
 _FETCH_AUR_META = f"/usr/bin/aria2c -x8 -j8 -s8 -k1M -d{_AUR_META_CACHE_DIR} {_AUR_META_URL}"
 _REFRESH_AGE = 24.0 * 60 * 60  # consider AUR metadata file as stale after a day
+# uncompressed size of AUR metadata beyond which it is parsed incrementally using ijson
+_AUR_META_MAX_LOAD_SIZE = 256 * 1024 * 1024
 _DEFAULT_SEP = "::::"  # something that does not appear in descriptions (at least so far)
 _PACKAGE_NAME_RE = re.compile(r"^[\w@.+-]+")  # used to strip out version comparisons
 
-# fields: name of original package, description, required dependencies, optional dependencies
-PackageAlternate = Tuple[str, str, list[str], list[str]]
+
+# Parallel maps of package names to their description, required and optional dependencies,
+# and of virtual package names (provides) to the name of the package that provides them.
+# The first package added for a name or provide wins which follows the search order of
+# pacman repositories followed by AUR.
+@dataclass
+class PackageMaps:
+    descs: dict[str, str] = field(default_factory=dict)
+    deps: dict[str, list[str]] = field(default_factory=dict)
+    opt_deps: dict[str, list[str]] = field(default_factory=dict)
+    provides: dict[str, str] = field(default_factory=dict)
+
+    def add(self, name: str, desc: str, deps: list[str], opt_deps: list[str],
+            provides: list[str]) -> None:
+        if name not in self.descs:
+            self.descs[name] = desc
+            self.deps[name] = deps
+            self.opt_deps[name] = opt_deps
+        for provide in provides:
+            self.provides.setdefault(provide, name)
+
+    # choose the package with the same name else the first one that provides it
+    def resolve(self, package: str) -> Optional[str]:
+        return package if package in self.descs else self.provides.get(package)
+
+    # load the maps from the cache file if its key matches the given one
+    def load(self, cache_file: str, key: list[Tuple[str, int]]) -> bool:
+        try:
+            with open(cache_file, "rb") as cache:
+                # key is pickled separately to avoid loading the maps if it does not match
+                if pickle.load(cache) != key:
+                    return False
+                self.descs, self.deps, self.opt_deps, self.provides = pickle.load(cache)
+                return True
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+
+    # the cache is only an optimization, so failure to write it is not fatal
+    def save(self, cache_file: str, key: list[Tuple[str, int]]) -> None:
+        # write to a temporary file and rename to avoid concurrent readers seeing a partial file
+        tmp_file = f"{cache_file}.{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(cache_file), mode=0o750, exist_ok=True)
+            with open(tmp_file, "wb") as cache:
+                pickle.dump(key, cache, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump((self.descs, self.deps, self.opt_deps, self.provides), cache,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError as err:
+            print_warn(f"Skipping write of package cache '{cache_file}': {err}")
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
 
 
 def main() -> None:
@@ -51,16 +115,21 @@ def main_argv(argv: list[str]) -> None:
     # otherwise the list can be too long and become pointless for the end-user
 
     print_notice(f"Searching dependencies of '{args.package}' in base Arch repositories")
-    # first get the list of all installed packages to eliminate installed packages
-    # (include their provides too)
-    installed_packages = set(
-        str(run_command(r"/usr/bin/expac %n\t%S", capture_output=True)).split())
-    # next build a map of all packages in pacman database from their provides, dependencies and
-    # optional dependencies; the map key will be original package name and their provides mapped
-    # to a tuple having the name, description with list of required and optional dependencies
-    all_packages = defaultdict[str, list[PackageAlternate]](list[PackageAlternate])
-    sep = args.separator
-    build_pacman_db_map(all_packages, sep)
+    # get the list of all installed packages to eliminate installed packages (include their
+    # provides too) in a separate thread that runs concurrently with the pacman database query
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        installed_query = executor.submit(run_command, r"/usr/bin/expac %n\t%S",
+                                          capture_output=True)
+        # build maps of all packages in pacman database to their description, dependencies and
+        # optional dependencies, including a map of their provides to the original package name
+        # (these are loaded from the cache if the pacman sync databases have not changed since)
+        all_packages = PackageMaps()
+        sep = args.separator
+        if not all_packages.load(_PACMAN_MAPS_CACHE,
+                                 sync_dbs_key := _cache_key(_pacman_sync_dbs())):
+            build_pacman_db_map(all_packages, sep)
+            all_packages.save(_PACMAN_MAPS_CACHE, sync_dbs_key)
+        installed_packages = set(str(installed_query.result()).split())
 
     opt_deps: dict[str, Tuple[str, int, bool]] = {}
     find_opt_deps(args.package, installed_packages, all_packages, opt_deps, args.level)
@@ -74,7 +143,7 @@ def main_argv(argv: list[str]) -> None:
             print(f"{prefix}{key}{sep}{desc}{sep}{level}{sep}{installed}")
 
 
-def build_pacman_db_map(arch_packages: defaultdict[str, list[PackageAlternate]], sep: str) -> None:
+def build_pacman_db_map(arch_packages: PackageMaps, sep: str) -> None:
     for package_list in str(run_command(f"/usr/bin/expac -S %n{sep}%d{sep}%S{sep}%E{sep}%o",
                                         capture_output=True)).splitlines():
         if not package_list:
@@ -83,10 +152,15 @@ def build_pacman_db_map(arch_packages: defaultdict[str, list[PackageAlternate]],
         deps = _process_pkg_names(required.split()) if required else []
         opt_deps = _process_pkg_names(optional.split()) if optional else []
         # arch linux packages are always lower case which is enforced below for the map
-        map_val = (name.lower(), desc, deps, opt_deps)
-        arch_packages[map_val[0]].append(map_val)
-        for provide in _process_pkg_names(provides.split()):
-            arch_packages[provide].append(map_val)
+        arch_packages.add(name.lower(), desc, deps, opt_deps, _process_pkg_names(provides.split()))
+
+
+def _pacman_sync_dbs() -> list[str]:
+    return glob.glob(_PACMAN_SYNC_DBS)
+
+
+def _cache_key(files: Iterable[str]) -> list[Tuple[str, int]]:
+    return [(file, os.stat(file).st_mtime_ns) for file in sorted(files)]
 
 
 def _process_pkg_names(pkgs: Optional[list[str]]) -> list[str]:
@@ -95,9 +169,14 @@ def _process_pkg_names(pkgs: Optional[list[str]]) -> list[str]:
 
 def refresh_aur_metadata() -> None:
     os.makedirs(_AUR_META_CACHE_DIR, mode=0o750, exist_ok=True)
-    # fetch AUR metadata if not present or older than a day
-    if (not os.access(_AUR_META_FILE, os.R_OK) or
-            time.time() > os.path.getctime(_AUR_META_FILE) + _REFRESH_AGE):
+    # fetch AUR metadata if not present, unreadable or older than a day (single stat for all)
+    try:
+        meta_stat = os.stat(_AUR_META_FILE)
+        stale = (time.time() > meta_stat.st_mtime + _REFRESH_AGE or
+                 not _is_readable(meta_stat))
+    except OSError:
+        stale = True
+    if stale:
         meta_file = Path(_AUR_META_FILE)
         meta_file.unlink(missing_ok=True)
         # delete any partial file in case of download failure
@@ -106,83 +185,103 @@ def refresh_aur_metadata() -> None:
             sys.exit(code)
 
 
-# using ijson instead of the standard json because latter always loads the entire
-# JSON in memory whereas here only a few fields are required
-def build_aur_db_map(aur_packages: defaultdict[str, list[PackageAlternate]],
-                     raise_error: bool) -> bool:
+def _is_readable(st: os.stat_result) -> bool:
+    # equivalent of os.access(R_OK) using the mode bits from an existing stat result
+    if (euid := os.geteuid()) == 0:
+        return True
+    if st.st_uid == euid:
+        return bool(st.st_mode & stat.S_IRUSR)
+    if st.st_gid == os.getegid() or st.st_gid in os.getgroups():
+        return bool(st.st_mode & stat.S_IRGRP)
+    return bool(st.st_mode & stat.S_IROTH)
+
+
+def build_aur_db_map(aur_packages: PackageMaps, raise_error: bool) -> bool:
     try:
-        with gzip.open(_AUR_META_FILE, mode="rt", encoding="utf-8") as aur_meta:
-            for package in ijson.items(aur_meta, "item"):
+        with gzip.open(_AUR_META_FILE, mode="rb") as aur_meta:
+            # decompress and parse the whole JSON at once using orjson which is much faster
+            # than streaming through ijson, but fall back to latter if the data is too large
+            if _aur_meta_size() <= _AUR_META_MAX_LOAD_SIZE:
+                packages = orjson.loads(aur_meta.read())
+            else:
+                packages = ijson.items(aur_meta, "item")
+            for package in packages:
                 desc = package.get("Description")
                 if not desc:
                     desc = ""
                 deps = _process_pkg_names(package.get("Depends"))
                 opt_deps = _process_pkg_names(package.get("OptDepends"))
                 # arch linux packages are always lower case which is enforced below for the map
-                map_val = (package.get("Name").lower(), desc, deps, opt_deps)
-                aur_packages[map_val[0]].append(map_val)
-                for provide in _process_pkg_names(package.get("Provides")):
-                    aur_packages[provide].append(map_val)
+                aur_packages.add(package.get("Name").lower(), desc, deps, opt_deps,
+                                 _process_pkg_names(package.get("Provides")))
         return True
-    except (gzip.BadGzipFile, EOFError, zlib.error):
+    except (OSError, EOFError, zlib.error, orjson.JSONDecodeError, ijson.JSONError):
         if raise_error:
             raise
         return False
 
 
-def find_opt_deps(package: str, installed: set[str],
-                  all_packages: defaultdict[str, list[PackageAlternate]],
-                  opt_deps: dict[str, Tuple[str, int, bool]], max_level: int,
-                  level: int = 1) -> None:
-    if level > max_level:
+def load_aur_db_map(all_packages: PackageMaps) -> None:
+    refresh_aur_metadata()
+    # use the cached maps of pacman+AUR packages if none of their sources have changed since
+    if all_packages.load(_ALL_MAPS_CACHE, _cache_key([*_pacman_sync_dbs(), _AUR_META_FILE])):
+        return
+    # if AUR metadata file is broken, then refresh it and try again
+    if not build_aur_db_map(all_packages, raise_error=False):
+        Path(_AUR_META_FILE).unlink(missing_ok=True)
+        refresh_aur_metadata()
+        build_aur_db_map(all_packages, raise_error=True)
+    all_packages.save(_ALL_MAPS_CACHE, _cache_key([*_pacman_sync_dbs(), _AUR_META_FILE]))
+
+
+def _aur_meta_size() -> int:
+    # the last four bytes of a gzip file has the uncompressed size (modulo 2^32)
+    with open(_AUR_META_FILE, "rb") as aur_meta:
+        aur_meta.seek(max(aur_meta.seek(0, os.SEEK_END) - 4, 0))
+        return int.from_bytes(aur_meta.read(4), "little")
+
+
+def find_opt_deps(package: str, installed: set[str], all_packages: PackageMaps,
+                  opt_deps: dict[str, Tuple[str, int, bool]], max_level: int) -> None:
+    if max_level < 1:
         return
     # arch linux names are always lower case though sometimes upper case parts can appear
     # in opt-depends field (e.g. 'hunspell-en_US' while package is 'hunspell-en_us')
     package = package.lower()
     # search all_packages to obtain the required and optional dependencies
-    if not (alternates := all_packages.get(package)):
-        if level == 1:
-            print_notice(f"Searching dependencies of '{package}' in AUR")
-            # fetch AUR metadata, populate into all_packages and try again
-            refresh_aur_metadata()
-            # if AUR metadata file is broken, then refresh it and try again
-            if not build_aur_db_map(all_packages, raise_error=False):
-                os.unlink(_AUR_META_FILE)
-                refresh_aur_metadata()
-                build_aur_db_map(all_packages, raise_error=True)
-            alternates = all_packages.get(package)
-    if not alternates:
-        if level == 1:
+    if not (name := all_packages.resolve(package)):
+        print_notice(f"Searching dependencies of '{package}' in AUR")
+        # fetch AUR metadata, populate into all_packages and try again
+        load_aur_db_map(all_packages)
+        if not (name := all_packages.resolve(package)):
             print_error(f"Package '{package}' not found")
             sys.exit(1)
-        else:
-            print_warn(f"Skipping unknown dependency '{package}'")
-            return
 
-    # choose the alternative with the same name else the first one
-    (_, _, required, opts) = search_alternates(package, alternates)
-
-    if opts:
-        for pkg in opts:
-            if pkg not in opt_deps:  # don't recurse on already encountered optional dependencies
+    # breadth-first search on the required dependencies that are not installed, where each
+    # package is processed only once at its lowest level even if it is reached by many paths
+    visited = {package, name}
+    queue = deque(((name, 1),))
+    while queue:
+        name, level = queue.popleft()
+        # lower case the names once upfront so that the check for already encountered optional
+        # dependencies matches the keys of opt_deps
+        for pkg in map(str.lower, all_packages.opt_deps[name]):
+            if pkg not in opt_deps:
                 # lookup description
-                dep_desc = ""
-                pkg = pkg.lower()
-                if opt_dep := all_packages.get(pkg):
-                    dep_desc = search_alternates(pkg, opt_dep)[1]
-                opt_deps[pkg] = (dep_desc, level, pkg in installed)
-    if required:
-        for pkg in required:
-            if pkg not in installed:
-                find_opt_deps(pkg, installed, all_packages, opt_deps, max_level, level + 1)
-
-
-def search_alternates(package_name: str, alternates: list[PackageAlternate]) -> PackageAlternate:
-    # choose the alternative with the same name else the first one
-    for alternate in alternates:
-        if alternate[0] == package_name:
-            return alternate
-    return alternates[0]
+                opt_dep = all_packages.resolve(pkg)
+                opt_deps[pkg] = (all_packages.descs[opt_dep] if opt_dep else "", level,
+                                 pkg in installed)
+        if level >= max_level:
+            continue
+        for pkg in all_packages.deps[name]:
+            if pkg in installed or (pkg := pkg.lower()) in visited:
+                continue
+            visited.add(pkg)
+            if not (dep_name := all_packages.resolve(pkg)):
+                print_warn(f"Skipping unknown dependency '{pkg}'")
+            elif dep_name == pkg or dep_name not in visited:
+                visited.add(dep_name)
+                queue.append((dep_name, level + 1))
 
 
 if __name__ == "__main__":
@@ -3,10 +3,14 @@ Configuration locations, distribution and box name of ybox container.
 """
 
 import os
+from functools import cached_property
 from typing import Optional
 
 from .env import Environ
 
+# directory in the container where the scripts shared with the container are mounted
+_TARGET_SCRIPTS_DIR = "/usr/local/ybox"
+
 
 class StaticConfiguration:
     """
@@ -17,28 +21,20 @@ class StaticConfiguration:
 
     def __init__(self, env: Environ, distribution: str, box_name: str):
         self._env = env
-        # set up the additional environment variables
-        os.environ["YBOX_DISTRIBUTION_NAME"] = distribution
-        os.environ["YBOX_CONTAINER_NAME"] = box_name
         self._distribution = distribution
         self._box_name = box_name
         self._box_image = f"{Consts.image_prefix()}/{distribution}/{box_name}"
         self._shared_box_image = f"{Consts.shared_image_prefix()}/{distribution}"
-        # timezone properties
-        self._localtime = None
-        self._timezone = None
-        if os.path.islink("/etc/localtime"):
-            self._localtime = os.readlink("/etc/localtime")
-        if os.path.exists("/etc/timezone"):
-            with open("/etc/timezone", "r", encoding="utf-8") as timezone:
-                self._timezone = timezone.read().rstrip("\n")
         container_dir = f"{env.data_dir}/{box_name}"
-        os.environ["YBOX_CONTAINER_DIR"] = container_dir
         self._configs_dir = f"{container_dir}/configs"
         self._target_configs_dir = f"{env.target_data_dir}/{box_name}/configs"
         self._scripts_dir = f"{container_dir}/ybox-scripts"
-        self._target_scripts_dir = "/usr/local/ybox"
-        os.environ["YBOX_TARGET_SCRIPTS_DIR"] = self.target_scripts_dir
+        self._target_scripts_dir = _TARGET_SCRIPTS_DIR
+        # set up the additional environment variables in one go
+        os.environ.update({"YBOX_DISTRIBUTION_NAME": distribution,
+                           "YBOX_CONTAINER_NAME": box_name,
+                           "YBOX_CONTAINER_DIR": container_dir,
+                           "YBOX_TARGET_SCRIPTS_DIR": _TARGET_SCRIPTS_DIR})
         self._status_file = f"{container_dir}/status"
         self._config_list = f"{self.scripts_dir}/config.list"
         self._app_list = f"{self.scripts_dir}/app.list"
@@ -73,15 +69,23 @@ class StaticConfiguration:
         """
         return self._shared_box_image if has_shared_root else self._box_image
 
-    @property
+    # the timezone properties are read lazily since most commands do not need them
+    @cached_property
     def localtime(self) -> Optional[str]:
         """the target link for /etc/localtime"""
-        return self._localtime
+        try:
+            return os.readlink("/etc/localtime")
+        except OSError:  # missing or not a symbolic link
+            return None
 
-    @property
+    @cached_property
     def timezone(self) -> Optional[str]:
         """the contents of /etc/timezone"""
-        return self._timezone
+        try:
+            with open("/etc/timezone", "r", encoding="utf-8") as timezone:
+                return timezone.read().rstrip("\n")
+        except FileNotFoundError:
+            return None
 
     @property
     def configs_dir(self) -> str:
@@ -45,6 +45,10 @@ class Environ:
         else:
             self._configuration_dirs = [Path(f"{self._home_dir}/.config/ybox"),
                                         pkg_dir.joinpath("conf")]
+        # string prefixes of the configuration directories to check for a file using the path
+        # string, so that `PathName` objects are created only for the one that is returned
+        self._configuration_prefixes = [f"{str(config_dir).rstrip('/')}/"
+                                        for config_dir in self._configuration_dirs]
         self._user_applications_dir = f"{user_base}/share/applications"
         self._user_executables_dir = f"{user_base}/bin"
 
@@ -61,10 +65,9 @@ class Environ:
         if os.path.isabs(conf_path):
             return Path(conf_path)
         # order is first search in user's config directory, and then the system config directory
-        for config_dir in self._configuration_dirs:
-            path = config_dir.joinpath(conf_path)
-            if os.access(path, os.R_OK):  # type: ignore
-                return path
+        for config_dir, prefix in zip(self._configuration_dirs, self._configuration_prefixes):
+            if os.access(prefix + conf_path, os.R_OK):
+                return config_dir.joinpath(conf_path)
         search_dirs = ', '.join([str(file) for file in self._configuration_dirs])
         if not quiet:
             print_error(f"Configuration file '{conf_path}' not found in [{search_dirs}]")
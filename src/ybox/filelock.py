@@ -4,6 +4,8 @@ Helper class for file locking with timeout support.
 
 import errno
 import fcntl
+import signal
+import threading
 import time
 from datetime import datetime
 from io import IOBase
@@ -12,10 +14,14 @@ from typing import Optional
 
 class FileLock:
     """
-    A simple file locker class that takes a fcntl() lock on given file with polling and timeout.
+    A simple file locker class that takes a fcntl() lock on given file with timeout.
     The lock file should always be separate from the resource being locked (if the resource
     is also a file).
 
+    In the main thread, this waits for the lock using a blocking call which is interrupted by
+    a SIGALRM timer on timeout, so the lock is acquired as soon as it is released. Other threads
+    cannot use signals, so fall back to polling for the lock at the given interval.
+
     The file is created on first access or truncated if it exists, and never removed thereafter
     to avoid any complications. Lock files on NFS files may or may not work as expected
     depending on the NFS server characteristics, so this class can safely be used only
@@ -35,6 +41,7 @@ class FileLock:
                           the resource being locked
         :param timeout_secs: lock timeout in seconds (use negative for infinite wait)
         :param poll_interval: polling interval at which to check for lock to be available
+                              when not running in the main thread
         """
         self._lock_file = lock_file
         self._lock_fd: Optional[IOBase] = None
@@ -43,33 +50,106 @@ class FileLock:
 
     def __enter__(self):
         success = False
-        self._lock_fd = open(self._lock_file, "w+", encoding="utf-8")
+        self._lock_fd = lock_fd = open(self._lock_file, "w+", encoding="utf-8")
         try:
-            start_time: Optional[datetime] = None
-            remaining_time = self._timeout
-            while remaining_time != 0:
-                try:
-                    fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    success = True
-                    return
-                except OSError as ex:
-                    if ex.errno in (errno.EACCES, errno.EAGAIN):
-                        # start proper timing only after first failure
-                        if not start_time:
-                            start_time = datetime.now()
-                        # wait for poll time, then try again
-                        time.sleep(self._poll)
-                        # treat -ve timeout as infinite where remaining_time will never reach 0
-                        if remaining_time > 0:
-                            remaining_time -= self._poll
-                            remaining_time = max(remaining_time, 0)
-                    else:
-                        raise
-            wait_time = (datetime.now() - start_time).total_seconds() if start_time else 0.0
-            raise TimeoutError(f"Failed to lock '{self._lock_file}' in {wait_time} seconds")
+            if self._timeout < 0:
+                # infinite wait is a plain blocking call
+                fcntl.lockf(lock_fd, fcntl.LOCK_EX)
+            elif threading.current_thread() is threading.main_thread():
+                self._lock_with_alarm(lock_fd)
+            else:
+                self._lock_with_polling(lock_fd)
+            success = True
         finally:
             if not success:
-                self._lock_fd.close()
+                lock_fd.close()
+
+    def _try_lock(self, lock_fd: IOBase) -> bool:
+        """
+        Try to acquire the lock without blocking.
+
+        :param lock_fd: the open lock file
+        :return: true if the lock was acquired and false if it is held by someone else
+        """
+        try:
+            fcntl.lockf(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError as ex:
+            if ex.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+
+    def _timeout_error(self, start_time: datetime) -> TimeoutError:
+        """create `TimeoutError` for failure to acquire the lock since the given start time"""
+        wait_time = (datetime.now() - start_time).total_seconds()
+        return TimeoutError(f"Failed to lock '{self._lock_file}' in {wait_time} seconds")
+
+    def _lock_with_alarm(self, lock_fd: IOBase) -> None:
+        """
+        Acquire the lock using a blocking call that is interrupted by a SIGALRM timer on timeout.
+        Any previous SIGALRM handler and timer are restored at the end.
+
+        :param lock_fd: the open lock file
+        """
+        if self._try_lock(lock_fd):
+            return
+        start_time = datetime.now()
+        if self._timeout == 0:
+            raise self._timeout_error(start_time)
+
+        waiting = True
+
+        def on_timeout(_signum, _frame):
+            # no-op once the blocking call is done, so the cleanup below is never interrupted
+            if waiting:
+                raise self._timeout_error(start_time)
+
+        # read the previous handler and timer upfront, so that the handler and timer are set
+        # inside the try block which ensures they are always restored
+        prev_handler = signal.getsignal(signal.SIGALRM)
+        prev_delay, prev_interval = signal.getitimer(signal.ITIMER_REAL)
+        try:
+            signal.signal(signal.SIGALRM, on_timeout)
+            signal.setitimer(signal.ITIMER_REAL, self._timeout)
+            try:
+                fcntl.lockf(lock_fd, fcntl.LOCK_EX)
+                waiting = False
+            except TimeoutError:
+                waiting = False
+                # the timer may have fired just after the lock was acquired but before the flag
+                # was cleared, in which case this process already holds the lock
+                if not self._try_lock(lock_fd):
+                    raise
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            # handler is None if it was not installed from python, so fall back to the default
+            signal.signal(signal.SIGALRM,
+                          signal.SIG_DFL if prev_handler is None else prev_handler)
+            if prev_delay > 0:
+                # rearm the previous timer for its remaining time (at least a tiny bit)
+                elapsed = (datetime.now() - start_time).total_seconds()
+                signal.setitimer(signal.ITIMER_REAL, max(prev_delay - elapsed, 1.0e-6),
+                                 prev_interval)
+
+    def _lock_with_polling(self, lock_fd: IOBase) -> None:
+        """
+        Acquire the lock by polling at the configured interval till timeout.
+
+        :param lock_fd: the open lock file
+        """
+        start_time: Optional[datetime] = None
+        remaining_time = self._timeout
+        while remaining_time != 0:
+            if self._try_lock(lock_fd):
+                return
+            # start proper timing only after first failure
+            if not start_time:
+                start_time = datetime.now()
+            # wait for poll time, then try again
+            time.sleep(self._poll)
+            remaining_time -= self._poll
+            remaining_time = max(remaining_time, 0)
+        raise self._timeout_error(start_time or datetime.now())
 
     def __exit__(self, ex_type, ex_value, ex_traceback):
         if self._lock_fd:
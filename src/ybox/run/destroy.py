@@ -17,10 +17,12 @@ def main_argv(argv: list[str]) -> None:
     container_name = args.container_name
 
     verify_ybox_state(docker_cmd, container_name, expected_states=[])
-    print_color(f"Stopping ybox container '{container_name}'", fg=fgcolor.cyan)
-    # continue even if this fails since the container may already be in stopped state
-    run_command([docker_cmd, "container", "stop", container_name],
-                exit_on_error=False, error_msg=f"stopping '{container_name}'")
+    # force removal stops the container too, so skip the separate stop command for that case
+    if not args.force:
+        print_color(f"Stopping ybox container '{container_name}'", fg=fgcolor.cyan)
+        # continue even if this fails since the container may already be in stopped state
+        run_command([docker_cmd, "container", "stop", container_name],
+                    exit_on_error=False, error_msg=f"stopping '{container_name}'")
 
     print_warn(f"Removing ybox container '{container_name}'")
     rm_args = [docker_cmd, "container", "rm"]
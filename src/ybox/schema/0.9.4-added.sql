@@ -0,0 +1,2 @@
+-- index on the config_hash column used to look up containers having an equivalent configuration
+CREATE INDEX container_config_hashes ON containers(config_hash);
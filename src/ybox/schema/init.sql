@@ -10,7 +10,10 @@ CREATE TABLE containers (
     configuration TEXT NOT NULL,
     -- if the container has been destroyed but still has packages installed in shared root
     -- then it is retained with a new unique name denoting a destroyed container
-    destroyed BOOL NOT NULL
+    destroyed BOOL NOT NULL,
+    -- hash of the normalized configuration used to look up containers having an
+    -- equivalent configuration
+    config_hash BLOB NOT NULL DEFAULT x''
 ) WITHOUT ROWID;
 
 -- all packages installed in ybox containers using ybox-pkg including dependencies
@@ -33,4 +36,7 @@ CREATE TABLE packages (
 CREATE INDEX package_containers ON packages(container);
 
 -- include the new tables and indexes added in version 0.9.1
-SOURCE '0.9.1-added.sql';
\ No newline at end of file
+SOURCE '0.9.1-added.sql';
+
+-- include the new indexes added in version 0.9.4
+SOURCE '0.9.4-added.sql';
\ No newline at end of file
@@ -9,8 +9,9 @@ ALTER TABLE containers ADD COLUMN destroyed BOOL NOT NULL DEFAULT false;
 -- corresponding entries in containers due to lack of container configuration information
 DELETE FROM packages WHERE container = '';
 
--- change comma-separated local_copies field to json
-UPDATE packages SET local_copies = JSON_FROM_CSV(local_copies);
+-- change comma-separated local_copies field to json array of strings (json_quote escapes all
+-- the special characters but not commas, so replace the commas with string separators)
+UPDATE packages SET local_copies = '[' || REPLACE(json_quote(local_copies), ',', '", "') || ']';
 
 -- make entries into package_deps reading from packages.type
 INSERT INTO package_deps
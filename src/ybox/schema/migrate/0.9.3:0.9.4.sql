@@ -0,0 +1,6 @@
+-- add the config_hash column to containers having hash of the normalized configuration
+ALTER TABLE containers ADD COLUMN config_hash BLOB NOT NULL DEFAULT x'';
+UPDATE containers SET config_hash = CONFIG_HASH(configuration);
+
+-- create the new index
+SOURCE '../0.9.4-added.sql';
@@ -3,6 +3,7 @@ Classes and methods for bookkeeping the state of ybox containers including the p
 installed on each container explicitly.
 """
 
+import hashlib
 import json
 import os
 import re
@@ -12,18 +13,24 @@ from configparser import ConfigParser
 from contextlib import closing
 from dataclasses import dataclass
 from enum import Enum, IntFlag, auto
+from functools import lru_cache
 from importlib.resources import files
 from io import StringIO
+from itertools import chain, product
 from pathlib import Path
 from typing import Optional, Tuple, Union
 from uuid import uuid4
 
-from packaging.version import parse as parse_version
+from packaging.version import Version, parse as parse_version
 
 import ybox
 from .env import Environ, PathName
 from .print import print_warn
 
+# compiled patterns for the user-defined SQL REGEXP function which is invoked for every row, so
+# avoid the lookup in the internal cache of the `re` module (which is also bounded and locked)
+_REGEXP_CACHE = lru_cache(maxsize=256)(re.compile)
+
 
 @dataclass
 class RuntimeConfiguration:
@@ -62,6 +69,53 @@ class DependencyType(str, Enum):
     SUGGESTION = "suggestion"
 
 
+def _ini_config_tuples(conf_str: str, skip_sections: frozenset[str],
+                       skip_base_keys: frozenset[str]) -> frozenset[tuple[str, str, Optional[str]]]:
+    """
+    Minimal parser for a container configuration in INI format as written by `ConfigParser`
+    with '=' as the only delimiter, case-sensitive keys and keys allowed without values.
+    Unlike `ConfigParser` it does not build a dictionary for each section, and skips the given
+    sections and keys of the [base] section as it goes. Multi-line values and comments are
+    handled like `ConfigParser`, but the [DEFAULT] section is treated like any other section.
+
+    :param conf_str: the container configuration as an INI format string
+    :param skip_sections: the sections to be skipped
+    :param skip_base_keys: the keys of the [base] section to be skipped
+    :return: set of tuples having the section, key and value (or None if there is no value)
+    """
+    values: dict[tuple[str, str], Optional[list[str]]] = {}
+    section: Optional[str] = None  # lines before the first section are ignored
+    skip_section = False
+    value_lines: Optional[list[str]] = None  # lines of the current value that can continue
+    key_indent = 0
+    for line in conf_str.splitlines():
+        if not (stripped := line.strip()):
+            # empty lines are part of multi-line values
+            if value_lines is not None:
+                value_lines.append("")
+            continue
+        if stripped[0] in "#;":  # full line comments
+            continue
+        indent = len(line) - len(line.lstrip())
+        # continuation of a multi-line value has more indentation than its key
+        if value_lines is not None and indent > key_indent:
+            value_lines.append(stripped)
+            continue
+        key_indent = indent
+        value_lines = None
+        if stripped[0] == "[" and (header_end := stripped.rfind("]")) > 1:
+            section = stripped[1:header_end]
+            skip_section = section in skip_sections
+        elif section is not None:
+            key, delim, value = stripped.partition("=")
+            key = key.rstrip()
+            value_lines = [value.strip()] if delim else None
+            if not (skip_section or (section == "base" and key in skip_base_keys)):
+                values[(section, key)] = value_lines
+    return frozenset((section, key, None if lines is None else "\n".join(lines).rstrip())
+                     for (section, key), lines in values.items())
+
+
 class YboxStateManagement:
     """
     Maintain the state of all ybox containers. This includes:
@@ -95,14 +149,38 @@ class YboxStateManagement:
 
     # last version when versioning and schema migration did not exist
     _PRE_SCHEMA_VERSION = parse_version("0.9.0")
-    # pattern to match "source '<file>'" in SQL script -- doesn't allow a quote in file name
-    _SOURCE_SQLCMD_RE = re.compile(r"^\s*source\s*'([^']+)'\s*;\s*", re.IGNORECASE)
+    # pattern to match "source '<file>'" lines in SQL script -- doesn't allow a quote in file name
+    _SOURCE_SQLCMD_RE = re.compile(r"^[^\S\n]*source[^\S\n]*'([^']+)'[^\S\n]*;[^\S\n]*(?:\n|\Z)",
+                                   re.IGNORECASE | re.MULTILINE)
+
+    # regular expression special characters: a pattern without any of these is a literal string
+    # and can be matched using equality (REGEXP uses full match) instead of calling into python
+    _REGEX_SPECIAL_CHARS_RE = re.compile(r"[.^$*+?{}\[\]\\|()]")
 
     # when comparing two container configurations, delete the sections mentioned below and the
-    # keys in the [base] section (specifically log-file in log-opts will change)
-    _CONFIG_NORMALIZE_DEL_SECTIONS = ["mounts", "configs", "env", "apps", "app_flags", "startup"]
-    _CONFIG_NORMALIZE_DEL_BASE_KEYS = ["name", "includes", "home", "config_hardlinks",
-                                       "log_driver", "log_opts"]
+    # keys in the [base] section (specifically log-file in log-opts will change);
+    # NOTE: the config_hash column of containers table stores the hash of the normalized
+    # configuration, so any change to these (or to `_ini_config_tuples`) requires a migration
+    # script that runs: UPDATE containers SET config_hash = CONFIG_HASH(configuration)
+    _CONFIG_NORMALIZE_DEL_SECTIONS = frozenset({"mounts", "configs", "env", "apps", "app_flags",
+                                                "startup"})
+    _CONFIG_NORMALIZE_DEL_BASE_KEYS = frozenset({"name", "includes", "home", "config_hardlinks",
+                                                 "log_driver", "log_opts"})
+
+    # queries used by `get_containers` for all combinations of the name, distribution and
+    # shared_root filters, so that the SQL text stays the same for a given combination
+    _GET_CONTAINERS_QUERIES = {
+        filters: "SELECT name FROM containers WHERE " + (" AND ".join(
+            predicate for predicate, enabled in zip(
+                ("name = ?", "distribution = ?", "shared_root = ?"), filters) if enabled) or
+            "1=1") + " ORDER BY name ASC" for filters in product((False, True), repeat=3)}
+
+    # settings applied to each connection: WAL journal allows readers to proceed concurrently
+    # with a writer and synchronous=NORMAL avoids a sync on every commit in WAL mode (which is
+    # still safe against application crashes); the rest keep temporary tables and indexes in
+    # memory and increase the page cache size (64MB) and the memory mapped I/O limit (256MB)
+    _CONNECTION_PRAGMAS = ("journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY",
+                           "cache_size=-65536", "mmap_size=268435456")
 
     def __init__(self, env: Environ):
         """
@@ -110,30 +188,30 @@ class YboxStateManagement:
 
         :param env: the current Environ
         """
-        # explicitly control transaction begin (in exclusive mode) since SERIALIZABLE isolation
+        # explicitly control transaction begin (in immediate mode) since SERIALIZABLE isolation
         # level is required while sqlite3 module will not start transactions before reads
         self._conn = sqlite3.connect(f"{env.data_dir}/state.db", timeout=60,
                                      isolation_level=None)
+        # journal_mode cannot be changed inside a transaction, so apply these before any
+        for pragma in self._CONNECTION_PRAGMAS:
+            self._conn.execute(f"PRAGMA {pragma}")
+        # cursor reused by the read-only getters that run outside any explicit transaction;
+        # if a separate connection is ever used for these, then it should set "query_only"
+        self._read_cursor = self._conn.cursor()
         # create the initial tables
         with closing(cursor := self._conn.cursor()):
             self._begin_transaction(cursor)
             self._conn.create_function("REGEXP", 2, self.regexp, deterministic=True)
-            self._conn.create_function("JSON_FROM_CSV", 1, self.json_from_csv, deterministic=True)
             self._conn.create_function("EQUIV_CONFIG", 2, self.equivalent_configuration,
                                        deterministic=True)
+            self._conn.create_function("CONFIG_HASH", 1, self.config_hash, deterministic=True)
             self._init_schema(cursor)
             self._conn.commit()
 
     @staticmethod
     def regexp(pattern: str, val: str) -> int:
         """callable for the user-defined SQL REGEXP function"""
-        # rely on python regex caching for efficient repeated calls
-        return 1 if re.fullmatch(pattern, val) else 0
-
-    @staticmethod
-    def json_from_csv(val: str) -> str:
-        """callable for the user-defined SQL JSON_FROM_CSV function"""
-        return json.dumps(val.split(","))
+        return 1 if _REGEXP_CACHE(pattern).fullmatch(val) else 0
 
     @staticmethod
     def equivalent_configuration(conf_str1: str, conf_str2: str) -> int:
@@ -143,39 +221,63 @@ class YboxStateManagement:
         of running the apps. Specifically the `log_opts` key from the `base` section has to
         be removed because the log-file name, when set based on time, will change in every run.
         """
-        config1 = ConfigParser(allow_no_value=True, interpolation=None, delimiters="=")
-        config1.optionxform = str  # type: ignore
-        with StringIO(conf_str1) as conf_io1:
-            config1.read_file(conf_io1)
-        YboxStateManagement.normalize_configuration(config1)
+        return int(YboxStateManagement._normalized_config_repr(conf_str1) ==
+                   YboxStateManagement._normalized_config_repr(conf_str2))
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _normalized_config_repr(conf_str: str) -> frozenset[tuple[str, str, Optional[str]]]:
+        """
+        Parse a container configuration in INI format skipping the sections/keys removed by
+        :func:`normalize_configuration` and return an immutable representation that can be
+        compared for equivalence. The result is cached since the same configurations are
+        compared repeatedly, e.g. the new container's configuration against destroyed ones.
 
-        config2 = ConfigParser(allow_no_value=True, interpolation=None, delimiters="=")
-        config2.optionxform = str  # type: ignore
-        with StringIO(conf_str2) as conf_io2:
-            config2.read_file(conf_io2)
-        YboxStateManagement.normalize_configuration(config2)
+        :param conf_str: the container configuration as an INI format string
+        :return: set of tuples having the section, key and value of the normalized configuration
+        """
+        return _ini_config_tuples(conf_str, YboxStateManagement._CONFIG_NORMALIZE_DEL_SECTIONS,
+                                  YboxStateManagement._CONFIG_NORMALIZE_DEL_BASE_KEYS)
 
-        return int(config1 == config2)
+    @staticmethod
+    def config_hash(conf_str: str) -> bytes:
+        """
+        Callable for the user-defined CONFIG_HASH function. This gives a hash of the normalized
+        configuration that is stored in the `config_hash` column of the `containers` table, so
+        that containers having an :func:`equivalent_configuration` can be looked up using
+        the hash. The hash does not depend on the order of sections and keys in `conf_str`.
+        """
+        normalized = json.dumps(sorted(YboxStateManagement._normalized_config_repr(conf_str)))
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
 
     @staticmethod
     def normalize_configuration(config: ConfigParser) -> None:
         """
         Normalize a configuration by deleting sections/keys that do not affect its overall
         behavior in running applications in the container.
+
+        This is the reference for :func:`_normalized_config_repr` which skips the same
+        sections/keys while parsing a configuration string without `ConfigParser`
+        (their equivalence on the bundled configurations is verified by the unit tests).
         """
-        for del_section in YboxStateManagement._CONFIG_NORMALIZE_DEL_SECTIONS:
+        # only the sections/keys actually present are removed to skip the failing lookups
+        for del_section in YboxStateManagement._CONFIG_NORMALIZE_DEL_SECTIONS.intersection(
+                config.sections()):
             config.remove_section(del_section)
-        for del_key in YboxStateManagement._CONFIG_NORMALIZE_DEL_BASE_KEYS:
+        for del_key in YboxStateManagement._CONFIG_NORMALIZE_DEL_BASE_KEYS.intersection(
+                config.options("base")):
             config.remove_option("base", del_key)
 
     @staticmethod
     def _begin_transaction(cursor: sqlite3.Cursor) -> None:
         """
-        Begin an EXCLUSIVE transaction to ensure atomicity of a group of reads and writes
+        Begin an IMMEDIATE transaction to ensure atomicity of a group of reads and writes.
+        This acquires the write lock upfront like an EXCLUSIVE transaction, but in WAL mode
+        it does not block the readers that do not use an explicit transaction.
 
         :param cursor: the `Cursor` object to use for execution
         """
-        cursor.execute("BEGIN EXCLUSIVE TRANSACTION")
+        cursor.execute("BEGIN IMMEDIATE TRANSACTION")
 
     def _init_schema(self, cursor: sqlite3.Cursor) -> None:
         """
@@ -183,8 +285,6 @@ class YboxStateManagement:
 
         :param cursor: the `Cursor` object to use for execution
         """
-        schema_pkg = files("ybox").joinpath("schema")
-        ver_sep = ":"
         new_version = parse_version(ybox.__version__)
         # full initialization if empty database, else migrate and update the version if required
         # ('containers' table exists in all versions)
@@ -196,26 +296,36 @@ class YboxStateManagement:
             else:  # version = 0.9.0
                 old_version = self._PRE_SCHEMA_VERSION
             if new_version != old_version:
-                # determine the migration scripts that need to be run
-                def check_version(file: str) -> bool:
-                    """check if the versions in the given migration script (<ver1>:<ver2>.sql)
-                       are within the stored schema version and current schema version"""
-                    return all((version := parse_version(ver)) and old_version <= version <=
-                               new_version for ver in file.removesuffix(".sql").split(ver_sep))
-
-                scripts = [file for file in schema_pkg.joinpath("migrate").iterdir()
-                           if file.is_file() and check_version(file.name)]
-                if scripts:
-                    if len(scripts) > 1:
-                        scripts.sort(key=lambda f: parse_version(f.name[:f.name.find(ver_sep)]))
-                    for script in scripts:
+                # run the migration scripts having versions within the stored schema version
+                # and current schema version in order
+                for script_old_ver, script_new_ver, script in self._migration_scripts():
+                    if old_version <= script_old_ver and script_new_ver <= new_version:
                         self._execute_script(script, cursor)
                 # finally update the version
                 cursor.execute("UPDATE schema SET version = ?", (str(new_version),))
         else:
-            self._execute_script(schema_pkg.joinpath("init.sql"), cursor)
+            self._execute_script(files("ybox").joinpath("schema").joinpath("init.sql"), cursor)
             cursor.execute("INSERT INTO schema VALUES (?)", (str(new_version),))
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _migration_scripts() -> tuple[Tuple[Version, Version, PathName], ...]:
+        """
+        Get the migration scripts in `ybox.schema.migrate` package with their versions. These
+        are determined only once and cached since the package contents do not change at runtime.
+
+        :return: tuples having the old version, new version and the migration script as a
+                 resource file from importlib (`Traversable`) sorted on the old version
+        """
+        scripts: list[Tuple[Version, Version, PathName]] = []
+        for file in files("ybox").joinpath("schema").joinpath("migrate").iterdir():
+            if file.is_file():
+                # file name is <old version>:<new version>.sql
+                old_version, new_version = file.name.removesuffix(".sql").split(":")
+                scripts.append((parse_version(old_version), parse_version(new_version), file))
+        scripts.sort(key=lambda script: script[0])
+        return tuple(scripts)
+
     @staticmethod
     def _table_exists(name: str, cursor: sqlite3.Cursor) -> bool:
         """
@@ -242,25 +352,20 @@ class YboxStateManagement:
         """
 
         # process all the "source" directives and include file contents recursively
-        def process_source(file: PathName, output_lines: list[str]) -> None:
+        def process_source(file: PathName) -> str:
+            def include_source(match: re.Match) -> str:
+                inc = match.group(1)
+                inc_file = Path(inc) if os.path.isabs(inc) \
+                    else file.parent.joinpath(inc)  # type: ignore
+                return process_source(inc_file)
+
             with file.open("r", encoding="utf-8") as sql_fd:
-                while sql := sql_fd.readline():
-                    if match := YboxStateManagement._SOURCE_SQLCMD_RE.fullmatch(sql):
-                        inc = match.group(1)
-                        inc_file = Path(inc) if os.path.isabs(inc) \
-                            else file.parent.joinpath(inc)  # type: ignore
-                        process_source(inc_file, output_lines)
-                    else:
-                        output_lines.append(sql)
-                        # readline() will convert all line endings to \n except possibly the last
-                        # one, so add a newline which might be missing in the middle of file
-                        # in recursive "source" include
-                        if sql[-1] != "\n":
-                            output_lines.append("\n")
-
-        sql_lines: list[str] = []
-        process_source(sql_file, sql_lines)
-        cursor.executescript("".join(sql_lines))
+                sql = YboxStateManagement._SOURCE_SQLCMD_RE.sub(include_source, sql_fd.read())
+            # add a newline which might be missing at the end of file for recursive "source"
+            # include in the middle of another file
+            return sql if not sql or sql[-1] == "\n" else sql + "\n"
+
+        cursor.executescript(process_source(sql_file))
 
     def register_container(self, container_name: str, distribution: str, shared_root: str,
                            parser: ConfigParser,
@@ -285,39 +390,44 @@ class YboxStateManagement:
                  (which can be used to recreate wrappers for container desktop/executable files)
         """
         packages: dict[str, Tuple[CopyType, dict[str, str]]] = {}
-        # build the ini string from parser
-        with StringIO() as config:
-            parser.write(config)
-            config.flush()
-            config_str = config.getvalue()
+        # build the ini string from parser and its hash before starting the write transaction
+        parser.write(config := StringIO())
+        config_str = config.getvalue()
+        config_hash = self.config_hash(config_str)
         with closing(cursor := self._conn.cursor()):
             self._begin_transaction(cursor)
             # the ybox container may have been destroyed from outside ybox tools, so unregister
             self._unregister_container(container_name, cursor)
-            cursor.execute("INSERT INTO containers VALUES (?, ?, ?, ?, false)",
-                           (container_name, distribution, shared_root, config_str))
+            cursor.execute("INSERT INTO containers VALUES (?, ?, ?, ?, false, ?)",
+                           (container_name, distribution, shared_root, config_str, config_hash))
             # Find the orphan packages with the same shared_root and assign to this container
             # but only if the destroyed container had the same shared root and configuration.
             if shared_root:
-                cursor.execute("SELECT dc.name FROM containers dc WHERE dc.destroyed = true AND "
-                               f"dc.shared_root = ? AND ({force_own_orphans} OR "
-                               "EQUIV_CONFIG(dc.configuration, ?))", (shared_root, config_str))
-                equiv_destroyed = [row[0] for row in cursor.fetchall()]
-                if equiv_destroyed:
-                    in_args = ", ".join(["?" for _ in equiv_destroyed])
-                    pkg_args = [container_name]
-                    pkg_args.extend(equiv_destroyed)
+                # compare the stored hashes of normalized configurations rather than using
+                # EQUIV_CONFIG in the query which would call back into python for each row;
+                # the destroyed containers are deleted right away since all their packages
+                # get reassigned below, so a separate lookup of their names is not required;
+                # separate statements are used so that the one comparing hashes can use the
+                # container_config_hashes index (an OR of the two conditions cannot use it)
+                if force_own_orphans:
+                    cursor.execute("DELETE FROM containers WHERE destroyed = true AND "
+                                   "shared_root = ? RETURNING name", (shared_root,))
+                else:
+                    cursor.execute("DELETE FROM containers WHERE destroyed = true AND "
+                                   "shared_root = ? AND config_hash = ? RETURNING name",
+                                   (shared_root, config_hash))
+                if equiv_destroyed := [row[0] for row in cursor]:
+                    # pass the destroyed containers as a single JSON array parameter so that
+                    # the statements below have the same SQL text regardless of their number
+                    args = (container_name, json.dumps(equiv_destroyed))
                     # reassign packages to this container having matching destroyed container
                     cursor.execute("UPDATE packages SET container = ? WHERE container IN "
-                                   f"({in_args}) RETURNING name, local_copy_type, flags", pkg_args)
+                                   "(SELECT value FROM json_each(?)) "
+                                   "RETURNING name, local_copy_type, flags", args)
                     packages = {name: (CopyType(cp_type), json.loads(flags)) for
-                                (name, cp_type, flags) in cursor.fetchall()}
-                    cursor.execute(
-                        f"UPDATE package_deps SET container = ? WHERE container IN ({in_args})",
-                        pkg_args)
-                    # get rid of destroyed containers whose packages all got reassigned
-                    cursor.execute(f"DELETE FROM containers WHERE name IN ({in_args})",
-                                   equiv_destroyed)
+                                (name, cp_type, flags) in cursor}
+                    cursor.execute("UPDATE package_deps SET container = ? WHERE container IN "
+                                   "(SELECT value FROM json_each(?))", args)
             self._conn.commit()
             return packages
 
@@ -348,42 +458,39 @@ class YboxStateManagement:
         :return: true if container was found in the database and removed
         """
         cursor.execute("DELETE FROM containers WHERE name = ? RETURNING distribution, "
-                       "shared_root, configuration", (container_name,))
+                       "shared_root, configuration, config_hash", (container_name,))
         # if the container has 'shared_root', then packages will continue to exist, but update
         # the entry in `containers` with a new unique name (else there can be clashes later)
         # and update the container name in package tables
         row = cursor.fetchone()
-        # check if there are any packages registered for the container
-        cursor.execute("SELECT 1 FROM packages WHERE container = ?", (container_name,))
-        if not cursor.fetchone():
+        # check if there are any packages registered for the container and get their local
+        # wrappers in the same query (UPDATE ... RETURNING gives the updated value, hence
+        # local_copies have to be read before they are cleared in the update below)
+        cursor.execute("SELECT local_copies FROM packages WHERE container = ?",
+                       (container_name,))
+        if not (pkg_row := cursor.fetchone()):
             return row is not None
+        local_copies = YboxStateManagement._extract_local_copies(
+            chain((pkg_row,), cursor))
 
-        distro, shared_root, config = row if row else (None, None, None)
+        distro, shared_root, config, config_hash = row if row else (None, None, None, None)
         if shared_root:
-            new_name = str(uuid4())  # generate a unique name
-            insert_done = False
-            while not insert_done:
-                try:
-                    cursor.execute("INSERT INTO containers VALUES (?, ?, ?, ?, true)",
-                                   (new_name, distro, shared_root, config))
-                    insert_done = True
-                except sqlite3.IntegrityError:
-                    # retry if unlucky (or buggy) to generate a UUID already generated in the past
-                    new_name = str(uuid4())
-            # UPDATE ... RETURNING gives the old value, hence getting local_copies separately
-            # and then update both container name and empty local_copies in a single update
-            cursor.execute("SELECT local_copies FROM packages WHERE container = ?",
-                           (container_name,))
-            local_copies = YboxStateManagement._extract_local_copies(cursor.fetchall())
+            # generate a unique name and retry if unlucky (or buggy) to generate a UUID already
+            # generated in the past in which case the INSERT below will not return any row
+            while True:
+                new_name = str(uuid4())
+                cursor.execute("INSERT INTO containers VALUES (?, ?, ?, ?, true, ?) "
+                               "ON CONFLICT(name) DO NOTHING RETURNING 1",
+                               (new_name, distro, shared_root, config, config_hash))
+                if cursor.fetchone():
+                    break
             # update container name to the new one for destroyed container and clear local_copies
             cursor.execute("UPDATE packages SET container = ?, local_copies = '[]' "
                            "WHERE container = ?", (new_name, container_name))
             cursor.execute("UPDATE package_deps SET container = ? WHERE container = ?",
                            (new_name, container_name))
         else:
-            cursor.execute("DELETE FROM packages WHERE container = ? RETURNING local_copies",
-                           (container_name,))
-            local_copies = YboxStateManagement._extract_local_copies(cursor.fetchall())
+            cursor.execute("DELETE FROM packages WHERE container = ?", (container_name,))
             cursor.execute("DELETE FROM package_deps WHERE container = ?", (container_name,))
         # remove the local wrapper files in both cases
         YboxStateManagement._remove_local_copies(local_copies)
@@ -395,43 +502,36 @@ class YboxStateManagement:
         shared root path (or empty if not using shared root), and its resolved configuration in
         INI format as a string.
 
+        This is a read-only query that runs without any explicit transaction, hence it does not
+        acquire the write lock and, in WAL mode, does not block (or get blocked by) any writers.
+
         :param name: name of the container
         :return: configuration of the container as a `RuntimeConfiguration` object
         """
-        with closing(cursor := self._conn.execute(
-                "SELECT distribution, shared_root, configuration FROM containers WHERE name = ?",
-                (name,))):
-            row = cursor.fetchone()
-            return RuntimeConfiguration(name=name, distribution=row[0], shared_root=row[1],
-                                        ini_config=row[2]) if row else None
+        cursor = self._read_cursor
+        cursor.execute(
+            "SELECT distribution, shared_root, configuration FROM containers WHERE name = ?",
+            (name,))
+        row = cursor.fetchone()
+        return RuntimeConfiguration(name=name, distribution=row[0], shared_root=row[1],
+                                    ini_config=row[2]) if row else None
 
     def get_containers(self, name: Optional[str] = None, distribution: Optional[str] = None,
                        shared_root: Optional[str] = None) -> list[str]:
         """
         Get the containers matching the given name, distribution and/or shared root location.
+        Like :meth:`get_container_configuration`, this is a read-only query that runs without
+        any explicit transaction and does not block (or get blocked by) any writers.
 
         :param name: name of the container (optional)
         :param distribution: the Linux distribution used when creating the container (optional)
         :param shared_root: the local shared root directory to search for a package (optional)
         :return: list of containers matching the given criteria
         """
-        predicate = ""
-        args: list[str] = []
-        if name:
-            predicate = "name = ? AND "
-            args.append(name)
-        if distribution:
-            predicate += "distribution = ? AND "
-            args.append(distribution)
-        if shared_root:
-            predicate += "shared_root = ?"
-            args.append(shared_root)
-        else:
-            predicate += "1=1"
-        with closing(cursor := self._conn.execute(
-                f"SELECT name FROM containers WHERE {predicate} ORDER BY name ASC", args)):
-            rows = cursor.fetchall()
-            return [str(row[0]) for row in rows]
+        query = self._GET_CONTAINERS_QUERIES[(bool(name), bool(distribution), bool(shared_root))]
+        cursor = self._read_cursor
+        cursor.execute(query, [arg for arg in (name, distribution, shared_root) if arg])
+        return [str(row[0]) for row in cursor]
 
     def register_package(self, container_name: str, package: str, local_copies: list[str],
                          copy_type: CopyType, app_flags: dict[str, str], shared_root: str,
@@ -457,18 +557,13 @@ class YboxStateManagement:
             # if there is an entry for an orphaned package in the same shared root, then remove it
             if shared_root:
                 # EXISTS query seems to be always faster than IN query in sqlite
-                cursor.execute("""
-                    DELETE from packages WHERE name = ? AND EXISTS (
-                        SELECT 1 FROM containers dc WHERE dc.destroyed = true AND
-                        dc.shared_root = ? AND packages.container = dc.name
-                    ) RETURNING container""", (package, shared_root))
-                if rows := cursor.fetchall():
-                    in_str = ", ".join(["?" for _ in rows])
-                    args = [package]
-                    for row in rows:
-                        args.append(row[0])
-                    cursor.execute("DELETE from package_deps WHERE name = ? AND "
-                                   f"container IN ({in_str})", args)
+                dc_exists = ("SELECT 1 FROM containers dc WHERE dc.destroyed = true AND "
+                             "dc.shared_root = ? AND p.container = dc.name")
+                cursor.execute(f"DELETE FROM packages AS p WHERE name = ? AND EXISTS ({dc_exists})",
+                               (package, shared_root))
+                if cursor.rowcount > 0:
+                    cursor.execute("DELETE FROM package_deps AS p WHERE name = ? AND "
+                                   f"EXISTS ({dc_exists})", (package, shared_root))
                     self._clean_destroyed_containers(cursor)
             cursor.execute("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?)",
                            (package, container_name, json.dumps(local_copies), copy_type.value,
@@ -556,24 +651,30 @@ class YboxStateManagement:
                 cursor.execute(orphans_query.format(pkgs_loc_query=pkgs_container_query,
                                                     o_deps_query=o_deps_container_query),
                                (package, container_name, package, container_name))
-            orphans = {dep: DependencyType(dep_type) for (dep, dep_type) in cursor.fetchall()}
+            orphans = {dep: DependencyType(dep_type) for (dep, dep_type) in cursor}
 
             # for the case of common shared root, delete package regardless of the container
             if shared_root:
                 # delete from the packages table
                 cursor.execute("DELETE FROM packages AS p WHERE name = ? AND EXISTS "
                                f"({sr_exists}) RETURNING local_copies", (package, shared_root))
-                local_copies = self._extract_local_copies(cursor.fetchall())
+                # collect the rows rather than use rowcount which is not reliable for
+                # DELETE ... RETURNING in older python versions (< 3.10)
+                rows = cursor.fetchall()
+                deleted = bool(rows)
+                local_copies = self._extract_local_copies(rows)
                 # and from the package_deps table (including dependency entries for the package)
                 cursor.execute("DELETE FROM package_deps AS p WHERE "
                                f"(name = ? OR dependency = ?) AND EXISTS ({sr_exists})",
                                (package, package, shared_root))
-                self._clean_destroyed_containers(cursor)
+                # a destroyed container can be left without packages only if one was deleted
+                if deleted:
+                    self._clean_destroyed_containers(cursor)
             else:
                 # delete from the packages and package_deps tables
                 cursor.execute("DELETE FROM packages WHERE name = ? AND container = ? "
                                "RETURNING local_copies", (package, container_name))
-                local_copies = self._extract_local_copies(cursor.fetchall())
+                local_copies = self._extract_local_copies(cursor)
                 cursor.execute("DELETE FROM package_deps WHERE (name = ? OR dependency = ?) "
                                "AND container = ?", (package, package, container_name))
             self._conn.commit()
@@ -590,23 +691,43 @@ class YboxStateManagement:
             )""")
 
     @staticmethod
-    def _extract_local_copies(rows: list, lc_idx: int = 0) -> list[str]:
+    def _extract_local_copies(rows: typing.Iterable, lc_idx: int = 0) -> list[str]:
         """
         Get a flattened list of local wrapper files from multiple rows having `local_copies`.
 
-        :param rows: rows from `Cursor.fetchall()` or equivalent with `local_copies`
+        :param rows: an `Iterable` over rows (e.g. the `Cursor` itself) with `local_copies`
         :param lc_idx: index of the row having the `local_copies` field
         :return: flattened list of all the local wrapper files from the `local_copies` fields
         """
-        # split local_copies field into an array using json then flatten
-        return [file for row in rows if row[lc_idx] for file in json.loads(row[lc_idx]) if file]
+        # join the local_copies arrays of all rows into an array of arrays to decode them in
+        # a single json call, then flatten
+        all_copies = json.loads(f"[{','.join(row[lc_idx] for row in rows if row[lc_idx])}]")
+        return [file for local_copies in all_copies for file in local_copies if file]
 
     @staticmethod
     def _remove_local_copies(local_copies: list[str]) -> None:
         """remove the files created locally to run container executables"""
+        # group the files by their directories and unlink relative to an open directory
+        # descriptor to avoid the lookup of the full path for every file
+        files_by_dir: dict[str, list[str]] = {}
         for file in local_copies:
-            print_warn(f"Removing local wrapper {file}")
-            Path(file).unlink(missing_ok=True)
+            file_dir, file_name = os.path.split(file)
+            files_by_dir.setdefault(file_dir, []).append(file_name)
+        for file_dir, file_names in files_by_dir.items():
+            for file_name in file_names:
+                print_warn(f"Removing local wrapper {os.path.join(file_dir, file_name)}")
+            try:
+                dir_fd = os.open(file_dir or ".", os.O_RDONLY | os.O_DIRECTORY)
+            except FileNotFoundError:
+                continue
+            try:
+                for file_name in file_names:
+                    try:
+                        os.unlink(file_name, dir_fd=dir_fd)
+                    except FileNotFoundError:
+                        pass
+            finally:
+                os.close(dir_fd)
 
     def get_packages(self, container_name: str, regex: str = ".*",
                      dependency_type: str = ".*") -> list[str]:
@@ -626,7 +747,7 @@ class YboxStateManagement:
             predicate = "container = ? AND "
             args.append(container_name)
         if regex != ".*":
-            predicate += "REGEXP(name, ?) AND "
+            predicate += f"name {self._match_operator(regex)} ? AND "
             args.append(regex)
         if dependency_type == ".*":
             predicate += "1=1"
@@ -634,13 +755,26 @@ class YboxStateManagement:
             predicate += ("NOT EXISTS (SELECT 1 FROM package_deps WHERE "
                           "packages.container = container AND packages.name = dependency)")
         else:
-            predicate += ("EXISTS (SELECT 1 FROM package_deps WHERE REGEXP(dep_type, ?) AND "
+            predicate += (f"EXISTS (SELECT 1 FROM package_deps WHERE dep_type "
+                          f"{self._match_operator(dependency_type)} ? AND "
                           "packages.container = container AND packages.name = dependency)")
             args.append(dependency_type)
         with closing(cursor := self._conn.cursor()):
             cursor.execute(
                 f"SELECT name FROM packages WHERE {predicate} ORDER BY name ASC", args)
-            return [str(row[0]) for row in cursor.fetchall()]
+            # iterate the cursor directly to avoid materializing an intermediate list of rows
+            return [str(row[0]) for row in cursor]
+
+    @staticmethod
+    def _match_operator(regex: str) -> str:
+        """
+        Get the SQL operator to match a column against the given regular expression which is
+        `=` if the regular expression has no special characters else `REGEXP`.
+
+        :param regex: the regular expression to be matched
+        :return: the SQL operator `=` or `REGEXP`
+        """
+        return "REGEXP" if YboxStateManagement._REGEX_SPECIAL_CHARS_RE.search(regex) else "="
 
     def check_packages(self, container_name: str, packages: typing.Iterable[str]) -> list[str]:
         """
@@ -653,14 +787,13 @@ class YboxStateManagement:
         """
         if not packages:
             return []
-        in_list = ", ".join(["?" for _ in packages])
-        args = [container_name]
-        for pkg in packages:
-            args.append(pkg)
+        # pass the packages as a single JSON array parameter so that the SQL text stays fixed
+        # regardless of the number of packages and the prepared statement gets reused
         with closing(cursor := self._conn.cursor()):
-            cursor.execute("SELECT name FROM packages pkgs "
-                           f"WHERE pkgs.container = ? AND pkgs.name IN ({in_list})", args)
-            return [str(row[0]) for row in cursor.fetchall()]
+            cursor.execute("SELECT name FROM packages pkgs WHERE pkgs.container = ? AND "
+                           "pkgs.name IN (SELECT value FROM json_each(?))",
+                           (container_name, json.dumps(list(packages))))
+            return [str(row[0]) for row in cursor]
 
     def close(self) -> None:
         """Close the underlying connection to the database."""
@@ -3,6 +3,9 @@
 import errno
 import fcntl
 import os
+import signal
+import threading
+import time
 import unittest
 from datetime import datetime
 from multiprocessing import Process
@@ -72,6 +75,9 @@ class TestFileLock(unittest.TestCase):
                 elapsed = (datetime.now() - start).total_seconds()
                 self.assertGreaterEqual(elapsed, 3.0)
                 self.assertLess(elapsed, 5.0)
+                # SIGALRM handler and timer should be restored after the timeout
+                self.assertEqual(signal.SIG_DFL, signal.getsignal(signal.SIGALRM))
+                self.assertEqual((0.0, 0.0), signal.getitimer(signal.ITIMER_REAL))
 
             self._run_in_process(do_lock)
 
@@ -98,6 +104,63 @@ class TestFileLock(unittest.TestCase):
 
             self._run_in_process(do_lock)
 
+    def test_wait_release(self) -> None:
+        """test that a waiting lock is acquired as soon as it is released"""
+        lock_file = self._lock_file
+        released_marker = f"{lock_file}.released"
+
+        def do_lock() -> None:
+            start = datetime.now()
+            # large poll interval should not matter when waiting in the main thread
+            with FileLock(lock_file, timeout_secs=30.0, poll_interval=30.0):
+                elapsed = (datetime.now() - start).total_seconds()
+                # lock should have been acquired only after the holder released it
+                assert os.path.exists(released_marker), "lock acquired before release"
+            # generous bound that is still well short of the poll interval
+            assert elapsed < 20.0, f"unexpected wait time {elapsed}"
+            # SIGALRM handler should be restored after acquiring the lock
+            assert signal.getsignal(signal.SIGALRM) == signal.SIG_DFL
+
+        try:
+            with FileLock(self._lock_file):
+                proc = Process(target=do_lock)
+                proc.start()
+                time.sleep(1.0)
+                with open(released_marker, "w", encoding="utf-8"):
+                    pass
+            proc.join()
+        finally:
+            if os.path.exists(released_marker):
+                os.unlink(released_marker)
+        self.assertEqual(0, proc.exitcode)
+
+    def test_poll_thread(self) -> None:
+        """test timeout with polling when locking in a thread other than the main thread"""
+        with FileLock(self._lock_file):
+            self.assertTrue(os.path.exists(self._lock_file))
+
+            def do_lock() -> None:
+                errors: list[BaseException] = []
+
+                def lock_in_thread() -> None:
+                    try:
+                        with FileLock(self._lock_file, timeout_secs=2.0, poll_interval=0.5):
+                            pass
+                    except BaseException as ex:  # pylint: disable=broad-exception-caught
+                        errors.append(ex)
+
+                start = datetime.now()
+                thread = threading.Thread(target=lock_in_thread)
+                thread.start()
+                thread.join()
+                elapsed = (datetime.now() - start).total_seconds()
+                self.assertEqual(1, len(errors))
+                self.assertIsInstance(errors[0], TimeoutError)
+                self.assertGreaterEqual(elapsed, 2.0)
+                self.assertLess(elapsed, 5.0)
+
+            self._run_in_process(do_lock)
+
     def tearDown(self) -> None:
         """tearDown will clean up the lock file"""
         Path(self._lock_file).unlink(missing_ok=True)
@@ -0,0 +1,349 @@
+"""Tests for `ybox/state.py`"""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from configparser import ConfigParser
+from contextlib import closing
+from io import StringIO
+from pathlib import Path
+
+import ybox
+from ybox.env import Environ
+from ybox.state import CopyType, DependencyType, YboxStateManagement
+
+
+class TestState(unittest.TestCase):
+    """unit tests for the `ybox.state` module"""
+
+    class TestEnviron(Environ):
+        """`Environ` that uses a temporary data directory to hold the state database"""
+
+        def __init__(self, data_dir: str):
+            super().__init__()
+            self._data_dir = data_dir
+
+    def setUp(self) -> None:
+        """setUp will create a temporary directory for the state database"""
+        self._data_dir = tempfile.mkdtemp(prefix="test_state-")
+        self._env = self.TestEnviron(self._data_dir)
+
+    def tearDown(self) -> None:
+        """tearDown will remove the temporary directory having the state database"""
+        shutil.rmtree(self._data_dir, ignore_errors=True)
+
+    def _register_packages(self, state: YboxStateManagement, container: str,
+                           packages: list[str]) -> None:
+        """register given packages for a container without any local wrappers or dependencies"""
+        for package in packages:
+            state.register_package(container, package, local_copies=[], copy_type=CopyType(0),
+                                   app_flags={}, shared_root="", dep_type=None, dep_of="")
+
+    @staticmethod
+    def _box_config(conf_str: str) -> ConfigParser:
+        """get a `ConfigParser` for the given container configuration string"""
+        config = ConfigParser(allow_no_value=True, interpolation=None, delimiters="=")
+        config.optionxform = str  # type: ignore
+        config.read_string(conf_str)
+        return config
+
+    def test_register_container(self) -> None:
+        """check reassignment of orphan packages on a shared root in `register_container`"""
+        shared_root = f"{self._data_dir}/ROOTS/arch"
+        conf = "[base]\nname = {name}\nshared_root = {shared_root}\nx11 = on\n"
+        wrapper = f"{self._data_dir}/firefox.desktop"
+        Path(wrapper).touch()
+        with YboxStateManagement(self._env) as state:
+            self.assertEqual({}, state.register_container(
+                "box1", "arch", shared_root,
+                self._box_config(conf.format(name="box1", shared_root=shared_root)), False))
+            state.register_package("box1", "firefox", [wrapper], CopyType.DESKTOP,
+                                   {"firefox": "-P"}, shared_root, dep_type=None, dep_of="")
+            state.register_package("box1", "firefox-ublock", [], CopyType(0), {}, shared_root,
+                                   dep_type=DependencyType.OPTIONAL, dep_of="firefox")
+            self.assertEqual(["box1"], state.get_containers(shared_root=shared_root))
+            self.assertTrue(state.unregister_container("box1"))
+            # local wrappers should be removed while the packages are orphaned
+            self.assertFalse(os.path.exists(wrapper))
+            self.assertNotIn("box1", state.get_containers())
+            self.assertEqual(["firefox", "firefox-ublock"], state.get_packages(""))
+            # non-equivalent configuration should not own the orphans
+            self.assertEqual({}, state.register_container(
+                "box2", "arch", shared_root, self._box_config(conf.format(
+                    name="box2", shared_root=shared_root).replace("x11 = on", "x11 = off")),
+                False))
+            self.assertEqual([], state.get_packages("box2"))
+            # equivalent configuration on the same shared root should own the orphans
+            self.assertEqual({"firefox": (CopyType.DESKTOP, {"firefox": "-P"}),
+                              "firefox-ublock": (CopyType(0), {})},
+                             state.register_container("box3", "arch", shared_root,
+                                                      self._box_config(conf.format(
+                                                          name="box3", shared_root=shared_root)),
+                                                      False))
+            self.assertEqual(["firefox", "firefox-ublock"], state.get_packages("box3"))
+            self.assertEqual(["firefox-ublock"],
+                             state.get_packages("box3", dependency_type="optional"))
+            self.assertEqual(["box2", "box3"], state.get_containers(shared_root=shared_root))
+            # force ownership of orphans for a non-equivalent configuration
+            self.assertTrue(state.unregister_container("box3"))
+            self.assertEqual({"firefox": (CopyType.DESKTOP, {"firefox": "-P"}),
+                              "firefox-ublock": (CopyType(0), {})},
+                             state.register_container("box2", "arch", shared_root,
+                                                      self._box_config(conf.format(
+                                                          name="box2", shared_root=shared_root)
+                                                          .replace("x11 = on", "x11 = off")),
+                                                      True))
+            self.assertEqual(["firefox", "firefox-ublock"], state.get_packages("box2"))
+            self.assertEqual(["box2"], state.get_containers())
+
+    def test_register_package(self) -> None:
+        """check that `register_package` removes the orphan entry of the package"""
+        shared_root = f"{self._data_dir}/ROOTS/arch"
+        conf = f"[base]\nshared_root = {shared_root}\n"
+        with YboxStateManagement(self._env) as state:
+            state.register_container("box1", "arch", shared_root, self._box_config(conf), False)
+            state.register_package("box1", "mpv", [], CopyType(0), {}, shared_root,
+                                   dep_type=None, dep_of="")
+            state.register_package("box1", "yt-dlp", [], CopyType(0), {}, shared_root,
+                                   dep_type=DependencyType.OPTIONAL, dep_of="mpv")
+            self.assertTrue(state.unregister_container("box1"))
+            self.assertEqual(1, len(state.get_containers(shared_root=shared_root)))
+            state.register_container("box2", "arch", shared_root,
+                                     self._box_config(conf + "x11 = on\n"), False)
+            self.assertEqual(2, len(state.get_containers(shared_root=shared_root)))
+            state.register_package("box2", "yt-dlp", [], CopyType(0), {}, shared_root,
+                                   dep_type=None, dep_of="")
+            # destroyed container should still remain since it owns mpv
+            self.assertEqual(["mpv", "yt-dlp"], state.get_packages(""))
+            self.assertEqual(2, len(state.get_containers(shared_root=shared_root)))
+            state.register_package("box2", "mpv", [], CopyType(0), {}, shared_root,
+                                   dep_type=None, dep_of="")
+            self.assertEqual(["mpv", "yt-dlp"], state.get_packages("box2"))
+            self.assertEqual(["mpv", "yt-dlp"], state.get_packages("", dependency_type=""))
+            self.assertEqual(["box2"], state.get_containers(shared_root=shared_root))
+
+    def test_unregister_package(self) -> None:
+        """check `unregister_package` for orphaned dependencies and destroyed containers"""
+        shared_root = f"{self._data_dir}/ROOTS/arch"
+        conf = f"[base]\nshared_root = {shared_root}\n"
+        with YboxStateManagement(self._env) as state:
+            state.register_container("box1", "arch", shared_root, self._box_config(conf), False)
+            state.register_package("box1", "mpv", [], CopyType(0), {}, shared_root,
+                                   dep_type=None, dep_of="")
+            state.register_package("box1", "yt-dlp", [], CopyType(0), {}, shared_root,
+                                   dep_type=DependencyType.OPTIONAL, dep_of="mpv")
+            self.assertTrue(state.unregister_container("box1"))
+            state.register_container("box2", "arch", shared_root,
+                                     self._box_config(conf + "x11 = on\n"), False)
+            self.assertEqual(2, len(state.get_containers(shared_root=shared_root)))
+            # removing a package not registered anywhere should leave everything as is
+            self.assertEqual({}, state.unregister_package("box2", "vlc", shared_root))
+            self.assertEqual(2, len(state.get_containers(shared_root=shared_root)))
+            # removing the orphaned package should also remove the empty destroyed container
+            self.assertEqual({"yt-dlp": DependencyType.OPTIONAL},
+                             state.unregister_package("box2", "mpv", shared_root))
+            self.assertEqual(["yt-dlp"], state.get_packages(""))
+            self.assertEqual(2, len(state.get_containers(shared_root=shared_root)))
+            # a no-op removal just before the last one should not affect the cleanup
+            self.assertEqual({}, state.unregister_package("box2", "vlc", shared_root))
+            self.assertEqual({}, state.unregister_package("box2", "yt-dlp", shared_root))
+            self.assertEqual([], state.get_packages(""))
+            self.assertEqual(["box2"], state.get_containers(shared_root=shared_root))
+
+    def test_unregister_container(self) -> None:
+        """check `unregister_container` for a container without shared root"""
+        wrappers = [f"{self._data_dir}/vlc.desktop", f"{self._data_dir}/vlc"]
+        for wrapper in wrappers:
+            Path(wrapper).touch()
+        with YboxStateManagement(self._env) as state:
+            state.register_container("box1", "arch", "", self._box_config("[base]\nname = box1"),
+                                     False)
+            # missing wrapper files or directories should be skipped when removing them
+            missing = [f"{self._data_dir}/missing.desktop", f"{self._data_dir}/missing/vlc"]
+            state.register_package("box1", "vlc", wrappers + missing,
+                                   CopyType.DESKTOP | CopyType.EXECUTABLE, {}, "", dep_type=None,
+                                   dep_of="")
+            state.register_package("box1", "vlc-plugins", [], CopyType(0), {}, "",
+                                   dep_type=DependencyType.SUGGESTION, dep_of="vlc")
+            self.assertEqual(["vlc", "vlc-plugins"], state.get_packages("box1"))
+            self.assertTrue(state.unregister_container("box1"))
+            self.assertFalse(any(os.path.exists(wrapper) for wrapper in wrappers))
+            self.assertEqual([], state.get_containers())
+            self.assertEqual([], state.get_packages(""))
+            self.assertIsNone(state.get_container_configuration("box1"))
+            self.assertFalse(state.unregister_container("box1"))
+
+    def test_journal_mode(self) -> None:
+        """check that the state database uses write-ahead logging"""
+        with YboxStateManagement(self._env) as state:
+            self._register_packages(state, "box1", ["vlc"])
+            # journal mode is persistent, so any other connection should see it as WAL
+            with closing(sqlite3.connect(f"{self._data_dir}/state.db")) as conn:
+                self.assertEqual("wal", conn.execute("PRAGMA journal_mode").fetchone()[0])
+                self.assertEqual([("vlc",)],
+                                 conn.execute("SELECT name FROM packages").fetchall())
+
+    def test_migration(self) -> None:
+        """check migration of the state database from the first version without schema table"""
+        # minimal schema of the first version (0.9.0) having comma-separated local_copies
+        with sqlite3.connect(f"{self._data_dir}/state.db") as conn:
+            conn.executescript("""
+                CREATE TABLE containers (name TEXT NOT NULL PRIMARY KEY,
+                    distribution TEXT NOT NULL, shared_root TEXT NOT NULL,
+                    configuration TEXT NOT NULL) WITHOUT ROWID;
+                CREATE TABLE packages (name TEXT NOT NULL, container TEXT NOT NULL,
+                    shared_root TEXT NOT NULL, type TEXT NOT NULL, local_copies TEXT NOT NULL,
+                    PRIMARY KEY(name, container)) WITHOUT ROWID;
+                INSERT INTO containers VALUES ('box1', 'arch', '', '[base]');
+                INSERT INTO packages VALUES ('firefox', 'box1', '', '',
+                    '/tmp/firefox.desktop,/tmp/bin/firefox');
+                INSERT INTO packages VALUES ('firefox-ublock', 'box1', '', 'optional(firefox)',
+                    '');
+                INSERT INTO packages VALUES ('orphan', '', '', '', '');""")
+            # paths having characters that need to be escaped in JSON strings
+            special_copies = ['/tmp/bin/a"b\\c\n', '/tmp/tab\t\x01.desktop']
+            conn.execute("INSERT INTO packages VALUES ('special', 'box1', '', '', ?)",
+                         (",".join(special_copies),))
+        conn.close()
+        with YboxStateManagement(self._env) as state:
+            self.assertEqual(["firefox", "firefox-ublock", "special"], state.get_packages("box1"))
+            self.assertEqual(["firefox-ublock"],
+                             state.get_packages("box1", dependency_type="optional"))
+        with sqlite3.connect(f"{self._data_dir}/state.db") as conn:
+            self.assertEqual([(ybox.__version__,)],
+                             conn.execute("SELECT version FROM schema").fetchall())
+            self.assertEqual([("firefox", '["/tmp/firefox.desktop", "/tmp/bin/firefox"]', 3, "{}"),
+                              ("firefox-ublock", '[""]', 0, "{}")], conn.execute(
+                "SELECT name, local_copies, local_copy_type, flags FROM packages "
+                "WHERE name != 'special' ORDER BY name").fetchall())
+            special_json = conn.execute(
+                "SELECT local_copies FROM packages WHERE name = 'special'").fetchone()[0]
+            self.assertEqual(special_copies, json.loads(special_json))
+            self.assertEqual([("box1", YboxStateManagement.config_hash("[base]"))], conn.execute(
+                "SELECT name, config_hash FROM containers").fetchall())
+        conn.close()
+
+    def test_regexp(self) -> None:
+        """check the callable for the user-defined SQL REGEXP function"""
+        self.assertEqual(1, YboxStateManagement.regexp("fire.*", "firefox"))
+        self.assertEqual(0, YboxStateManagement.regexp("fire", "firefox"))
+        self.assertEqual(1, YboxStateManagement.regexp("fire", "fire"))
+        self.assertEqual(0, YboxStateManagement.regexp("(a|b)+", "abc"))
+        self.assertEqual(1, YboxStateManagement.regexp("(a|b)+c", "abc"))
+
+    def test_equivalent_configuration(self) -> None:
+        """check equivalence of container configurations used for reassigning orphan packages"""
+        conf = """[base]
+name = box1
+home = /home/box1
+shared_root = /home/shared
+x11 = on
+log_opts = path=/tmp/box1-1.log
+
+[security]
+caps = NET_ADMIN
+ipc
+[mounts]
+data = /data:/data
+"""
+        equiv_conf = """[security]
+ipc
+caps = NET_ADMIN
+
+[base]
+x11 = on
+shared_root = /home/shared
+log_opts = path=/tmp/box2-2.log
+name = box2
+
+[apps]
+firefox = firefox
+"""
+        self.assertEqual(1, YboxStateManagement.equivalent_configuration(conf, conf))
+        self.assertEqual(1, YboxStateManagement.equivalent_configuration(conf, equiv_conf))
+        self.assertEqual(1, YboxStateManagement.equivalent_configuration(equiv_conf, conf))
+        self.assertEqual(0, YboxStateManagement.equivalent_configuration(
+            conf, conf.replace("x11 = on", "x11 = off")))
+        self.assertEqual(0, YboxStateManagement.equivalent_configuration(
+            conf, conf.replace("ipc\n", "")))
+        self.assertEqual(0, YboxStateManagement.equivalent_configuration(
+            equiv_conf, equiv_conf.replace("[security]", "[env]")))
+        # multi-line values and comments
+        ml_conf = "[base]\nname = box1\n# comment\ndirs = /etc,\n  /usr\n\n  /var\n\n"
+        self.assertEqual(1, YboxStateManagement.equivalent_configuration(
+            ml_conf, "[base]\ndirs=/etc,\n\t/usr\n\n\t# comment\n\t/var\n"))
+        self.assertEqual(0, YboxStateManagement.equivalent_configuration(
+            ml_conf, "[base]\ndirs = /etc,\n/usr\n\n/var\n"))
+
+    def test_normalized_config_parser(self) -> None:
+        """check that the configuration parser used for equivalence checks gives the same
+           result as `ConfigParser` with `normalize_configuration` on the bundled profiles"""
+        # pylint: disable=protected-access
+        ini_files = sorted(Path(ybox.__file__).parent.joinpath("conf").rglob("*.ini"))
+        self.assertTrue(ini_files)
+        for ini_file in ini_files:
+            with self.subTest(ini_file=ini_file.name):
+                raw_conf = ini_file.read_text(encoding="utf-8")
+                config = self._box_config(raw_conf)
+                # also check with the configuration as written by `ConfigParser` and stored
+                # in the state database
+                written_conf = StringIO()
+                config.write(written_conf)
+                YboxStateManagement.normalize_configuration(config)
+                expected = frozenset((section, key, value) for section in config.sections()
+                                     for key, value in config.items(section, raw=True))
+                for conf_str in (raw_conf, written_conf.getvalue()):
+                    self.assertEqual(expected,
+                                     YboxStateManagement._normalized_config_repr(conf_str))
+
+    def test_config_hash(self) -> None:
+        """check that hash of equivalent configurations are the same"""
+        conf = "[base]\nname = box1\nx11 = on\nipc\n[security]\ncaps = NET_ADMIN\n"
+        equiv_conf = "[security]\ncaps = NET_ADMIN\n[base]\nipc\nname = box2\nx11 = on\n"
+        self.assertEqual(16, len(YboxStateManagement.config_hash(conf)))
+        self.assertEqual(YboxStateManagement.config_hash(conf),
+                         YboxStateManagement.config_hash(equiv_conf))
+        self.assertNotEqual(YboxStateManagement.config_hash(conf),
+                            YboxStateManagement.config_hash(conf.replace("ipc\n", "")))
+        self.assertNotEqual(YboxStateManagement.config_hash(conf),
+                            YboxStateManagement.config_hash(conf.replace("on", "off")))
+
+    def test_get_packages(self) -> None:
+        """check filtering of packages using regular expressions in `get_packages`"""
+        with YboxStateManagement(self._env) as state:
+            self._register_packages(state, "box1", ["firefox", "firefox-ublock", "vlc"])
+            self._register_packages(state, "box2", ["fish", "vlc"])
+            state.register_dependency("box1", "firefox", "firefox-ublock",
+                                      DependencyType.OPTIONAL)
+            self.assertEqual(["firefox", "firefox-ublock", "vlc"], state.get_packages("box1"))
+            self.assertEqual(["firefox", "firefox-ublock"],
+                             state.get_packages("box1", regex="fire.*"))
+            self.assertEqual(["firefox-ublock", "fish"], state.get_packages("", regex="f.*(k|h)"))
+            self.assertEqual(["vlc", "vlc"], state.get_packages("", regex="vlc"))
+            self.assertEqual([], state.get_packages("box2", regex="fire.*"))
+            self.assertEqual(["firefox", "vlc"], state.get_packages("box1", dependency_type=""))
+            self.assertEqual(["firefox-ublock"],
+                             state.get_packages("box1", dependency_type="opt.*"))
+            self.assertEqual([], state.get_packages("box1", dependency_type="required"))
+            # patterns without special characters are matched for equality
+            self.assertEqual(["firefox"], state.get_packages("box1", regex="firefox"))
+            self.assertEqual(["firefox-ublock"],
+                             state.get_packages("", dependency_type="optional"))
+
+    def test_check_packages(self) -> None:
+        """check the filtering of registered packages using `check_packages`"""
+        with YboxStateManagement(self._env) as state:
+            self._register_packages(state, "box1", ["firefox", "firefox-ublock", "vlc"])
+            self._register_packages(state, "box2", ["fish", "vlc"])
+            self.assertEqual([], state.check_packages("box1", []))
+            self.assertEqual(["firefox", "vlc"], sorted(
+                state.check_packages("box1", ["vlc", "fish", "firefox", "chromium"])))
+            self.assertEqual(["fish"], state.check_packages("box2", ("fish", "firefox")))
+            self.assertEqual([], state.check_packages("box3", ["vlc"]))
+
+
+if __name__ == '__main__':
+    unittest.main()